@@ -1,47 +1,88 @@
 import os
+import re
+import sys
 import math
 import time
+import queue
+import atexit
+import signal
 import logging
 import threading
 import requests
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from flask import Flask, request
+from waitress import serve
 from telegram import Update, ParseMode
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
 
 # =============================
 # CONFIGURATION
 # =============================
-BOT_TOKEN  = os.environ.get("BOT_TOKEN")
-RENDER_URL = os.environ.get("RENDER_URL")  # e.g. https://colorelephantbot.onrender.com
-PORT       = int(os.environ.get("PORT", 8443))
-PING_DELAY = 5  # seconds between health pings
+BOT_TOKEN      = os.environ.get("BOT_TOKEN")
+RENDER_URL     = os.environ.get("RENDER_URL")  # e.g. https://colorelephantbot.onrender.com
+PORT           = int(os.environ.get("PORT", 8443))
+PING_DELAY     = 5  # seconds between health pings
+UPDATE_WORKERS = 8  # per-chat update queues (one thread each)
+DELETE_WORKERS = 8  # threads issuing /reset deletions
+WSGI_THREADS   = 8  # waitress request threads
+LOG_FILE       = "bot.log"
+LOG_BACKUPS    = 1  # days of rotated bot.log to keep
+LOG_TO_STDERR  = os.environ.get("LOG_TO_STDERR", "1") != "0"  # set to 0 to log only to bot.log
 
 # =============================
 # LOGGING
 # =============================
-logging.basicConfig(
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    level=logging.INFO,
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()],
-)
+log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+
+file_handler = TimedRotatingFileHandler(LOG_FILE, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8")
+file_handler.setFormatter(log_formatter)
+log_handlers = [file_handler]
+
+if LOG_TO_STDERR:
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(log_formatter)
+    log_handlers.append(stream_handler)
+
+# Request threads only enqueue records; the listener thread does the writes.
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
 logger = logging.getLogger(__name__)
 
 # =============================
 # FLASK APP
 # =============================
 app = Flask(__name__)
+# One single-threaded queue per bucket keeps each chat's updates in order.
+update_executors = [ThreadPoolExecutor(max_workers=1) for _ in range(UPDATE_WORKERS)]
 
 @app.route("/")
 def home():
-    logger.info("[PING] Root endpoint hit.")
+    logger.debug("[PING] Root endpoint hit.")
     return "✅ Bot is running and healthy."
 
 @app.route("/" + BOT_TOKEN, methods=["POST"])
 def webhook():
     update = Update.de_json(request.get_json(force=True), updater.bot)
-    dispatcher.process_update(update)
+    chat = update.effective_chat
+    bucket = (chat.id if chat else update.update_id) % UPDATE_WORKERS
+    update_executors[bucket].submit(process_update, update)
     return "ok", 200
 
+def process_update(update):
+    """Dispatch an update off the request thread, logging any failure."""
+    try:
+        dispatcher.process_update(update)
+    except Exception:
+        logger.exception("[WEBHOOK ERROR]")
+
 # =============================
 # HEALTH PINGER THREAD
 # =============================
@@ -52,17 +93,54 @@ def ping_self():
         try:
             r = requests.get(url, timeout=4)
             if r.status_code == 200:
-                logger.info(f"[HEALTH] Ping OK → {url}")
+                logger.debug("[HEALTH] Ping OK → %s", url)
             else:
-                logger.warning(f"[HEALTH] Ping failed ({r.status_code})")
+                logger.warning("[HEALTH] Ping failed (%s)", r.status_code)
         except Exception as e:
-            logger.error(f"[HEALTH] Ping exception: {e}")
+            logger.error("[HEALTH] Ping exception: %s", e)
         time.sleep(PING_DELAY)
 
 # =============================
 # BOT LOGIC
 # =============================
 user_state = {}
+delete_executor = ThreadPoolExecutor(max_workers=DELETE_WORKERS)
+
+CASE1_PERC = (10, 10, 15, 30, 55)
+CASE2_PERC = (10, 25, 65)
+BALANCE_RE = re.compile(r"\d+(?:\.\d*)?|\.\d+")
+
+def percent_of(balance, pct):
+    """Return pct% of balance, rounded down (integer math for whole balances)."""
+    if isinstance(balance, int):
+        return balance * pct // 100
+    return math.floor(balance * pct / 100)
+
+def case_amounts(balance):
+    """Return the (Case I, Case II) round amounts for a balance."""
+    case1 = tuple(percent_of(balance, p) for p in CASE1_PERC)
+    case2 = tuple(percent_of(balance, p) for p in CASE2_PERC)
+    return case1, case2
+
+@lru_cache(maxsize=1024)
+def cases_message(balance):
+    """Build the Case I & Case II reply for a balance."""
+    case1_amounts, case2_amounts = case_amounts(balance)
+    return (
+        f"✅ *Your balance:* ₹{math.floor(balance)}\n\n"
+        f"📊 *CASE I*\n"
+        f"Round 1️⃣: ₹{case1_amounts[0]}\n"
+        f"Round 2️⃣: ₹{case1_amounts[1]}\n"
+        f"Round 3️⃣: ₹{case1_amounts[2]}\n"
+        f"Round 4️⃣: ₹{case1_amounts[3]}\n"
+        f"Round 5️⃣: ₹{case1_amounts[4]}\n\n"
+        f"📉 *CASE II*\n"
+        f"Round 1️⃣: ₹{case2_amounts[0]}\n"
+        f"Round 2️⃣: ₹{case2_amounts[1]}\n"
+        f"Round 3️⃣: ₹{case2_amounts[2]}\n\n"
+        f"💡 All amounts are rounded down to the previous whole number.\n\n"
+        f"⚠️ Kindly use /reset before starting a new session to clear cache."
+    )
 
 def start(update: Update, context: CallbackContext):
     """Start command – ask user for balance."""
@@ -72,75 +150,60 @@ def start(update: Update, context: CallbackContext):
         "💰 Please enter your *current balance* (numbers only):",
         parse_mode=ParseMode.MARKDOWN,
     )
-    logger.info(f"/start from {user_id}")
+    logger.info("/start from %s", user_id)
+
+def delete_message_quietly(bot, chat_id, msg_id):
+    """Delete a message; return False if it couldn't be deleted."""
+    try:
+        bot.delete_message(chat_id=chat_id, message_id=msg_id)
+        return True
+    except Exception:
+        return False  # undeletable, already gone, or flood-limited
 
 def reset(update: Update, context: CallbackContext):
     """Reset current user's session and delete recent 20 messages."""
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
 
+    # Clear user's state before the slow deletions so a following /start isn't wiped
+    user_state.pop(user_id, None)
+    if hasattr(context, "user_data"):
+        context.user_data.clear()
+
     try:
-        # Delete last 20 messages to avoid delay
+        # Delete last 20 messages concurrently to avoid delay
         current_msg_id = update.message.message_id
-        for msg_id in range(current_msg_id, current_msg_id - 20, -1):
-            try:
-                context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-            except Exception:
-                pass  # ignore undeletable messages
+        msg_ids = range(current_msg_id, current_msg_id - 20, -1)
+        results = delete_executor.map(partial(delete_message_quietly, context.bot, chat_id), msg_ids)
+        skipped = sum(1 for deleted in results if not deleted)
 
-        # Clear user's state
-        if user_id in user_state:
-            del user_state[user_id]
-
-        if hasattr(context, "user_data"):
-            context.user_data.clear()
-
-        logger.info(f"[RESET] Cleared chat for user {user_id} (last 20 messages).")
+        if skipped:
+            logger.warning("[RESET] Cleared chat for user %s; %s of last 20 messages not deleted.", user_id, skipped)
+        else:
+            logger.info("[RESET] Cleared chat for user %s (last 20 messages).", user_id)
 
     except Exception as e:
-        logger.error(f"[RESET ERROR] {e}")
+        logger.error("[RESET ERROR] %s", e)
         update.message.reply_text("⚠️ Unable to clear messages completely, but your session has been reset.")
 
 def handle_message(update: Update, context: CallbackContext):
     """Handle balance input and display Case I & Case II directly."""
     user_id = update.effective_user.id
     text = update.message.text.strip()
-    state = user_state.get(user_id, {}).get("stage")
+    session = user_state.get(user_id)
+    state = session["stage"] if session else None
 
     # Wait for balance input
     if state == "WAITING_FOR_BALANCE":
-        if not text.replace(".", "", 1).isdigit():
+        if not BALANCE_RE.fullmatch(text):
             update.message.reply_text("❌ Kindly enter *numbers only.*", parse_mode=ParseMode.MARKDOWN)
             return
 
-        balance = float(text)
+        balance = float(text) if "." in text else int(text)
         user_state.pop(user_id, None)
-        logger.info(f"[BALANCE INPUT] {user_id} entered balance {balance}")
-
-        # Calculate case amounts
-        case1_perc = [10, 10, 15, 30, 55]
-        case2_perc = [10, 25, 65]
-        case1_amounts = [math.floor(balance * p / 100) for p in case1_perc]
-        case2_amounts = [math.floor(balance * p / 100) for p in case2_perc]
-
-        # Compose response
-        message = (
-            f"✅ *Your balance:* ₹{math.floor(balance)}\n\n"
-            f"📊 *CASE I*\n"
-            f"Round 1️⃣: ₹{case1_amounts[0]}\n"
-            f"Round 2️⃣: ₹{case1_amounts[1]}\n"
-            f"Round 3️⃣: ₹{case1_amounts[2]}\n"
-            f"Round 4️⃣: ₹{case1_amounts[3]}\n"
-            f"Round 5️⃣: ₹{case1_amounts[4]}\n\n"
-            f"📉 *CASE II*\n"
-            f"Round 1️⃣: ₹{case2_amounts[0]}\n"
-            f"Round 2️⃣: ₹{case2_amounts[1]}\n"
-            f"Round 3️⃣: ₹{case2_amounts[2]}\n\n"
-            f"💡 All amounts are rounded down to the previous whole number.\n\n"
-            f"⚠️ Kindly use /reset before starting a new session to clear cache."
-        )
-
-        update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
+        logger.info("[BALANCE INPUT] %s entered balance %s", user_id, balance)
+
+        update.message.reply_text(cases_message(balance), parse_mode=ParseMode.MARKDOWN)
         return
 
     update.message.reply_text("Send /start to begin or /reset to clear your chat.")
@@ -148,7 +211,11 @@ def handle_message(update: Update, context: CallbackContext):
 # =============================
 # TELEGRAM INITIALIZATION
 # =============================
-updater = Updater(BOT_TOKEN, use_context=True)
+updater = Updater(
+    BOT_TOKEN,
+    use_context=True,
+    request_kwargs={"con_pool_size": UPDATE_WORKERS + DELETE_WORKERS},
+)
 dispatcher = updater.dispatcher
 
 dispatcher.add_handler(CommandHandler("start", start))
@@ -160,8 +227,15 @@ dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_me
 # =============================
 if __name__ == "__main__":
     webhook_url = f"{RENDER_URL}/{BOT_TOKEN}"
-    updater.bot.set_webhook(webhook_url)
-    logger.info(f"✅ Webhook set to {webhook_url}")
+    # Only messages are handled; don't let Telegram push any other update type.
+    updater.bot.set_webhook(
+        webhook_url,
+        allowed_updates=["message"],
+    )
+    logger.info("✅ Webhook set to %s", webhook_url)
+
+    # Render stops the service with SIGTERM; exit normally so atexit flushes the log queue.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     threading.Thread(target=ping_self, daemon=True).start()
-    app.run(host="0.0.0.0", port=PORT)
\ No newline at end of file
+    serve(app, host="0.0.0.0", port=PORT, threads=WSGI_THREADS)
\ No newline at end of file